@@ -1,66 +1,186 @@
 import re
+import os
+import sys
 import csv
+import io
+import json
 import requests
+from requests.adapters import HTTPAdapter
 import concurrent.futures
 import asyncio
 import aiohttp
-import os
+import time
+import heapq
 import threading
-from queue import Queue
 import argparse
-
-# 归一化频道名称
+import socket
+from collections import defaultdict
+from functools import lru_cache
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import aiodns  # noqa: F401  aiohttp.AsyncResolver 依赖 aiodns
+    HAS_AIODNS = True
+except ImportError:
+    HAS_AIODNS = False
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# m3u8中第一个非注释行（TS分片或子播放列表）
+TS_LINE_RE = re.compile(rb'^[ \t]*([^#\s][^\r\n]*)', re.M)
+# 读取m3u8的前64KB即可找到第一个分片
+PLAYLIST_READ_SIZE = 64 * 1024
+# TS分片测速最多读取2MB，读满即断开；不发Range头，很多嵌入式服务器会忽略或拒绝它
+SEGMENT_READ_SIZE = 2 * 1024 * 1024
+# 字节数换算为MB的系数
+BYTES_PER_MB = 1.0 / (1024 * 1024)
+
+# 每个频道最多保留的源数量
+MAX_SOURCES_PER_CHANNEL = 8
+
+# 输出文件中的频道分类，按此顺序输出
+GENRES = ('央视频道', '卫视频道', '其他频道')
+
+# 频道名称归一化规则；"高清"须先于"超高"整体去掉（如"超高清"应得"超"），单独用str.replace处理
+NAME_DROP_RE = re.compile(r"超高|HD|标清|频道|-| |\(|\)")
+PLUS_RE = re.compile(r"PLUS|＋")
+CCTV_SUFFIX_RE = re.compile(r"CCTV(\d+)台")
+DIGIT_RE = re.compile(r'\d+')
+NAME_MAP = {
+    "CCTV1综合": "CCTV1", "CCTV2财经": "CCTV2", "CCTV3综艺": "CCTV3",
+    "CCTV4国际": "CCTV4", "CCTV4中文国际": "CCTV4", "CCTV4欧洲": "CCTV4",
+    "CCTV5体育": "CCTV5", "CCTV6电影": "CCTV6", "CCTV7军事": "CCTV7",
+    "CCTV7军农": "CCTV7", "CCTV7农业": "CCTV7", "CCTV7国防军事": "CCTV7",
+    "CCTV8电视剧": "CCTV8", "CCTV9记录": "CCTV9", "CCTV9纪录": "CCTV9",
+    "CCTV10科教": "CCTV10", "CCTV11戏曲": "CCTV11", "CCTV12社会与法": "CCTV12",
+    "CCTV13新闻": "CCTV13", "CCTV新闻": "CCTV13", "CCTV14少儿": "CCTV14",
+    "CCTV15音乐": "CCTV15", "CCTV16奥林匹克": "CCTV16",
+    "CCTV17农业农村": "CCTV17", "CCTV17农业": "CCTV17",
+    "CCTV5+体育赛视": "CCTV5+", "CCTV5+体育赛事": "CCTV5+", "CCTV5+体育": "CCTV5+"
+}
+
+# 归一化频道名称，同名频道只计算一次
+@lru_cache(maxsize=8192)
 def channel_name_normalize(name):
-    for rep in ["高清", "超高", "HD", "标清", "频道", "-", " ", "PLUS", "＋", "(", ")"]:
-        name = name.replace(rep, "" if rep not in ["PLUS", "＋"] else "+")
-    name = re.sub(r"CCTV(\d+)台", r"CCTV\1", name)
-    name_map = {
-        "CCTV1综合": "CCTV1", "CCTV2财经": "CCTV2", "CCTV3综艺": "CCTV3",
-        "CCTV4国际": "CCTV4", "CCTV4中文国际": "CCTV4", "CCTV4欧洲": "CCTV4",
-        "CCTV5体育": "CCTV5", "CCTV6电影": "CCTV6", "CCTV7军事": "CCTV7",
-        "CCTV7军农": "CCTV7", "CCTV7农业": "CCTV7", "CCTV7国防军事": "CCTV7",
-        "CCTV8电视剧": "CCTV8", "CCTV9记录": "CCTV9", "CCTV9纪录": "CCTV9",
-        "CCTV10科教": "CCTV10", "CCTV11戏曲": "CCTV11", "CCTV12社会与法": "CCTV12",
-        "CCTV13新闻": "CCTV13", "CCTV新闻": "CCTV13", "CCTV14少儿": "CCTV14",
-        "CCTV15音乐": "CCTV15", "CCTV16奥林匹克": "CCTV16",
-        "CCTV17农业农村": "CCTV17", "CCTV17农业": "CCTV17",
-        "CCTV5+体育赛视": "CCTV5+", "CCTV5+体育赛事": "CCTV5+", "CCTV5+体育": "CCTV5+"
-    }
-    name = name_map.get(name, name)
-    return name
+    name = NAME_DROP_RE.sub("", name.replace("高清", ""))
+    name = PLUS_RE.sub("+", name)
+    name = CCTV_SUFFIX_RE.sub(r"CCTV\1", name)
+    return NAME_MAP.get(name, name)
 
 # 获取频道名称中的数字
 def channel_key(channel_name):
-    match = re.search(r'\d+', channel_name)
+    match = DIGIT_RE.search(channel_name)
     if match:
         return int(match.group())
     return float('inf')
 
+# 频道排序：CCTV按编号在前，其余按名称
+def channel_sort_key(item):
+    name = item[0]
+    if name.startswith('CCTV'):
+        return (0, channel_key(name))
+    return (1, name)
+
+# 获取频道所属的分类，同名频道只计算一次
+@lru_cache(maxsize=8192)
+def channel_genres(channel_name):
+    genres = []
+    if 'CCTV' in channel_name:
+        genres.append(GENRES[0])
+    if '卫视' in channel_name:
+        genres.append(GENRES[1])
+    if not genres and '测试' not in channel_name:
+        genres.append(GENRES[2])
+    return tuple(genres)
+
+# 拆分URL为协议、主机和端口
+def split_url(url):
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname, parts.port
+
 # 生成同一C段的所有IP的URL
-def generate_ip_range_urls(base_url, ip_address, port, suffix=None):
+def generate_ip_range_urls(scheme, ip_address, port, suffix=None):
     ip_parts = ip_address.split('.')
     if len(ip_parts) < 3:
-        return []
-    c_prefix = '.'.join(ip_parts[:3])
-    return [f"{base_url}{c_prefix}.{i}{port}{suffix if suffix else ''}" for i in range(1, 256)]
-
-# 固定并发数，移除对psutil的依赖
-def adjust_concurrency():
-    return 100  # 使用固定的默认并发数
+        return iter(())
+    prefix = f"{scheme}://{'.'.join(ip_parts[:3])}."
+    tail = f"{':' + str(port) if port else ''}{suffix if suffix else ''}"
+    return (prefix + str(i) + tail for i in range(1, 256))
+
+# 将种子URL扩展为所在C段的全部URL
+def expand_ip_ranges(urls, suffix=None):
+    ip_range_urls = set()
+    for url in urls:
+        try:
+            scheme, host, port = split_url(url)
+        except ValueError:
+            continue
+        if host:
+            ip_range_urls.update(generate_ip_range_urls(scheme, resolve_host(host), port, suffix))
+    return ip_range_urls
+
+# 解析主机名为IP，同一主机只解析一次
+@lru_cache(maxsize=None)
+def resolve_host(host):
+    try:
+        return socket.gethostbyname(host)
+    except (socket.gaierror, UnicodeError):
+        return host
+
+# 创建启用DNS缓存的aiohttp连接器
+def create_connector(limit=1024):
+    resolver = aiohttp.AsyncResolver() if HAS_AIODNS else None
+    return aiohttp.TCPConnector(resolver=resolver, use_dns_cache=True, ttl_dns_cache=300, limit=limit)
+
+# 有uvloop时用其事件循环运行协程，否则回退到asyncio
+def run_async(coro):
+    return uvloop.run(coro) if uvloop else asyncio.run(coro)
+
+# 默认并发数：C段扫描为I/O密集型，测速受带宽限制
+SCAN_CONCURRENCY = 512
+SPEED_CONCURRENCY = 64
+# 同一服务器上的频道很多，限制单主机并发测速，避免互相抢带宽拉低测速结果
+SPEED_LIMIT_PER_HOST = 8
+
+# 根据任务数量调整并发数，不超过上限
+def adjust_concurrency(task_count, limit=SCAN_CONCURRENCY):
+    return max(1, min(limit, task_count))
+
+# 每个线程复用一个Session，保持HTTP长连接
+thread_local = threading.local()
+
+def get_session():
+    session = getattr(thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        thread_local.session = session
+    return session
 
 # 增加超时重试机制
 def is_url_accessible(url, retries=3):
+    session = get_session()
     for _ in range(retries):
         try:
-            response = requests.get(url, timeout=1)
-            return url if response.status_code == 200 else None
+            with session.get(url, timeout=1, stream=True) as response:
+                return url if response.status_code == 200 else None
         except requests.RequestException:
             continue
     return None
 
 # 并发检测URL可用性
-def check_urls_concurrent(urls, timeout=1, print_valid=True):
-    max_workers = adjust_concurrency()
+def check_urls_concurrent(urls, timeout=1, print_valid=True, concurrency=SCAN_CONCURRENCY):
+    max_workers = adjust_concurrency(len(urls), concurrency)
 
     def check_url(url):
         return is_url_accessible(url)
@@ -77,7 +197,7 @@ def check_urls_concurrent(urls, timeout=1, print_valid=True):
     return valid_urls
 
 # jsmpeg模式获取频道
-def get_channels_alltv(csv_file):
+def get_channels_alltv(csv_file, concurrency=SCAN_CONCURRENCY):
     urls = set()
     with open(csv_file, 'r', encoding='utf-8-sig') as f:
         reader = csv.DictReader(f)
@@ -88,21 +208,15 @@ def get_channels_alltv(csv_file):
             if host:
                 urls.add(host if host.startswith(('http://', 'https://')) else f"http://{host}")
 
-    ip_range_urls = []
-    for url in urls:
-        ip_start = url.find("//") + 2
-        ip_end = url.find(":", ip_start)
-        base_url = url[:ip_start]
-        ip_address = url[ip_start:ip_end]
-        port = url[ip_end:]
-        ip_range_urls.extend(generate_ip_range_urls(base_url, ip_address, port))
-
-    valid_urls = check_urls_concurrent(set(ip_range_urls))
+    ip_range_urls = expand_ip_ranges(urls)
+
+    valid_urls = check_urls_concurrent(ip_range_urls, concurrency=concurrency)
     channels = []
+    session = get_session()
     for url in valid_urls:
         json_url = f"{url.rstrip('/')}/streamer/list"
         try:
-            json_data = requests.get(json_url, timeout=1).json()
+            json_data = json_loads(session.get(json_url, timeout=1).content)
             host = url.rstrip('/')
             for item in json_data:
                 name = item.get('name', '').strip()
@@ -115,85 +229,68 @@ def get_channels_alltv(csv_file):
     return channels
 
 # txiptv模式获取频道（异步）
-async def get_channels_newnew(csv_file):
+async def get_channels_newnew(csv_file, concurrency=SCAN_CONCURRENCY):
     with open(csv_file, 'r', encoding='utf-8-sig') as f:
         reader = csv.DictReader(f)
         urls = list(set(row.get('link', '').strip() for row in reader if row.get('link')))
 
-    async def modify_urls(url):
-        ip_start = url.find("//") + 2
-        ip_end = url.find(":", ip_start)
-        base_url = url[:ip_start]
-        ip_address = url[ip_start:ip_end]
-        ip_parts = ip_address.split('.')
-        if len(ip_parts) < 3:
-            return []
-        c_prefix = '.'.join(ip_parts[:3])
-        port = url[ip_end:]
-        ip_end = "/iptv/live/1000.json?key=txiptv"
-        return [f"{base_url}{c_prefix}.{i}{port}{ip_end}" for i in range(1, 256)]
-
     async def is_url_accessible(session, url, semaphore):
         async with semaphore:
             try:
-                async with session.get(url, timeout=1) as response:
+                async with session.get(url, timeout=probe_timeout) as response:
                     return url if response.status == 200 else None
             except (aiohttp.ClientError, asyncio.TimeoutError):
                 return None
 
-    async def check_urls(session, urls, semaphore):
-        tasks = []
-        for url in urls:
-            modified_urls = await modify_urls(url)
-            tasks.extend(asyncio.create_task(is_url_accessible(session, modified_url, semaphore)) for modified_url in modified_urls)
-        results = await asyncio.gather(*tasks)
-        valid_urls = [result for result in results if result]
-        for url in valid_urls:
-            print(url)
-        return valid_urls
+    async def iter_valid_urls(session, urls, semaphore):
+        tasks = [asyncio.create_task(is_url_accessible(session, url, semaphore)) for url in urls]
+        for coro in asyncio.as_completed(tasks):
+            result = await coro
+            if result:
+                print(result)
+                yield result
 
     async def fetch_json(session, url, semaphore):
         async with semaphore:
             try:
-                ip_start = url.find("//") + 2
-                ip_index = url.find("/", url.find(".") + 1)
-                base_url = url[:ip_start]
-                ip_address = url[ip_start:ip_index]
-                url_x = f"{base_url}{ip_address}"
-                json_data = await session.get(url, timeout=1).json()
+                parts = urlsplit(url)
+                url_x = f"{parts.scheme}://{parts.netloc}"
+                async with session.get(url) as response:
+                    json_data = json_loads(await response.read())
+                # 扫描到的主机返回内容不可信，逐层检查类型
+                data = json_data.get('data') if isinstance(json_data, dict) else None
+                if not isinstance(data, list):
+                    return []
                 channels = []
-                for item in json_data.get('data', []):
+                for item in data:
                     if isinstance(item, dict):
                         name = item.get('name')
                         urlx = item.get('url')
-                        if ',' in urlx:
-                            urlx = "aaaaaaaa"
+                        if not isinstance(name, str) or not isinstance(urlx, str):
+                            continue
+                        if not name or not urlx or ',' in urlx:
+                            continue
                         urld = urlx if 'http' in urlx else f"{url_x}{urlx}"
-                        if name and urlx:
-                            channels.append((channel_name_normalize(name), urld))
+                        channels.append((channel_name_normalize(name), urld))
                 return channels
-            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, AttributeError):
                 return []
 
-    x_urls = []
-    for url in urls:
-        ip_start = url.find("//") + 2
-        ip_end = url.find(":", ip_start)
-        ip_dot = url.find(".") + 1
-        ip_address = url[ip_start:url.find(".", ip_dot, url.find(".", ip_dot + 1)) + 1]
-        port = url[ip_end:]
-        x_urls.append(f"{url[:ip_start]}{ip_address}1{port}")
-
-    unique_urls = set(x_urls)
-    semaphore = asyncio.Semaphore(500)
-    async with aiohttp.ClientSession() as session:
-        valid_urls = await check_urls(session, unique_urls, semaphore)
-        tasks = [asyncio.create_task(fetch_json(session, url, semaphore)) for url in valid_urls]
-        results = await asyncio.gather(*tasks)
-        return [channel for sublist in results for channel in sublist]
+    ip_range_urls = expand_ip_ranges(urls, "/iptv/live/1000.json?key=txiptv")
+    semaphore = asyncio.Semaphore(concurrency)
+    probe_timeout = aiohttp.ClientTimeout(total=1)
+    async with aiohttp.ClientSession(connector=create_connector(concurrency), timeout=aiohttp.ClientTimeout(total=3)) as session:
+        # 探测到可用地址后立即开始获取频道列表，与剩余探测并行
+        tasks = []
+        async for url in iter_valid_urls(session, ip_range_urls, semaphore):
+            tasks.append(asyncio.create_task(fetch_json(session, url, semaphore)))
+        channels = []
+        for coro in asyncio.as_completed(tasks):
+            channels.extend(await coro)
+        return channels
 
 # zhgxtv模式获取频道
-def get_channels_hgxtv(csv_file):
+def get_channels_hgxtv(csv_file, concurrency=SCAN_CONCURRENCY):
     urls = set()
     with open(csv_file, 'r', encoding='utf-8-sig') as csvfile:
         reader = csv.DictReader(csvfile)
@@ -203,153 +300,147 @@ def get_channels_hgxtv(csv_file):
                 url = host if host.startswith(('http://', 'https://')) else f"http://{host}{':80' if ':' not in host else ''}"
                 urls.add(url)
 
-    ip_range_urls = []
-    for url in urls:
-        ip_start = url.find("//") + 2
-        ip_end = url.find(":", ip_start)
-        base_url = url[:ip_start]
-        ip_address = url[ip_start:ip_end]
-        port = url[ip_end:]
-        ip_range_urls.extend(generate_ip_range_urls(base_url, ip_address, port, "/ZHGXTV/Public/json/live_interface.txt"))
-
-    valid_urls = check_urls_concurrent(set(ip_range_urls))
+    ip_range_urls = expand_ip_ranges(urls, "/ZHGXTV/Public/json/live_interface.txt")
+
+    valid_urls = check_urls_concurrent(ip_range_urls, concurrency=concurrency)
     channels = []
+    session = get_session()
     for url in valid_urls:
         try:
-            json_data = requests.get(url, timeout=1).content.decode('utf-8')
-            for line in json_data.split('\n'):
-                line = line.strip()
-                if line:
-                    name, channel_url = line.split(',')
-                    urls_parts = channel_url.split('/', 3)
-                    url_data_parts = url.split('/', 3)
-                    urld = f"{urls_parts[0]}//{url_data_parts[2]}/{urls_parts[3]}" if len(urls_parts) >= 4 else f"{urls_parts[0]}//{url_data_parts[2]}"
-                    channels.append((channel_name_normalize(name), urld))
-        except:
+            json_data = session.get(url, timeout=1).content.decode('utf-8')
+        except (requests.RequestException, UnicodeDecodeError):
             continue
+        host = url.split('/', 3)[2]
+        for line in json_data.split('\n'):
+            line = line.strip()
+            if line.count(',') != 1:
+                continue
+            name, channel_url = line.split(',')
+            urls_parts = channel_url.split('/', 3)
+            urld = f"{urls_parts[0]}//{host}/{urls_parts[3]}" if len(urls_parts) >= 4 else f"{urls_parts[0]}//{host}"
+            channels.append((channel_name_normalize(name), urld))
     return channels
 
 # 测试频道速度并输出结果
-def test_speed_and_output(channels, output_prefix="itvlist"):
-    task_queue = Queue()
+# 测速超时：按单次连接/读取计时，与原requests的timeout含义一致
+PLAYLIST_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=1, sock_read=1)
+SEGMENT_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=5)
+
+# 协程并发测速，连接池大小即并发上限
+async def probe_speeds(channels, concurrency=SPEED_CONCURRENCY):
     speed_results = []
     error_channels = []
 
-    def worker():
-        while True:
-            channel_name, channel_url = task_queue.get()
-            try:
-                channel_url_t = channel_url.rstrip(channel_url.split('/')[-1])
-                lines = requests.get(channel_url, timeout=1).text.strip().split('\n')
-                ts_lists = [line for line in lines if not line.startswith('#')]
-                if not ts_lists:
-                    raise Exception("No valid TS files found.")
-                ts_url = channel_url_t + ts_lists[0].split('/')[-1]
-                start_time = os.times()[0]
-                content = requests.get(ts_url, timeout=5).content
-                end_time = os.times()[0]
-                response_time = end_time - start_time
-                if content:
-                    file_size = len(content)
-                    download_speed = file_size / response_time / 1024
-                    normalized_speed = min(max(download_speed / 1024, 0.001), 100)
-                    speed_results.append((channel_name, channel_url, f"{normalized_speed:.3f} MB/s"))
-            except:
-                error_channels.append((channel_name, channel_url))
-            finally:
-                progress = (len(speed_results) + len(error_channels)) / len(channels) * 100
-                print(f"可用频道：{len(speed_results)} 个 , 不可用频道：{len(error_channels)} 个 , 总频道：{len(channels)} 个 ,总进度：{progress:.2f} %。")
-                task_queue.task_done()
-
-    num_threads = 50
-    for _ in range(num_threads):
-        threading.Thread(target=worker, daemon=True).start()
-
-    for channel in channels:
-        task_queue.put(channel)
-    task_queue.join()
-
-    # 按速度排序并筛选每个频道最多8个源
-    from collections import defaultdict
+    async def probe(session, channel):
+        channel_name, channel_url = channel
+        try:
+            async with session.get(channel_url, timeout=PLAYLIST_TIMEOUT) as response:
+                try:
+                    playlist_head = await response.content.readexactly(PLAYLIST_READ_SIZE)
+                except asyncio.IncompleteReadError as e:
+                    playlist_head = e.partial
+            ts_match = TS_LINE_RE.search(playlist_head)
+            if not ts_match:
+                return None
+            ts_line = ts_match.group(1).decode('utf-8').strip()
+            ts_url = urljoin(channel_url, ts_line)
+            start_time = time.perf_counter()
+            async with session.get(ts_url, timeout=SEGMENT_TIMEOUT) as response:
+                # 错误页（4xx/5xx）不能当作分片参与测速排名
+                if response.status not in (200, 206):
+                    return None
+                try:
+                    content = await response.content.readexactly(SEGMENT_READ_SIZE)
+                except asyncio.IncompleteReadError as e:
+                    content = e.partial
+            response_time = max(time.perf_counter() - start_time, 1e-6)
+            if not content:
+                return None
+            download_speed = len(content) * BYTES_PER_MB / response_time
+            normalized_speed = min(max(download_speed, 0.001), 100)
+            return (channel_name, channel_url, normalized_speed)
+        except Exception:
+            return None
+
+    def host_of(url):
+        try:
+            return urlsplit(url).netloc
+        except ValueError:
+            return url
+
+    async def probe_channel(session, channel):
+        # 信号量限制同时测速的频道数；每个测速同一时刻只占一个连接，
+        # 连接池不小于信号量，计时中的请求不会排队等待空闲连接。
+        # 先排主机队列再占全局名额，等待繁忙主机的任务不占用全局并发，排队也不计入测速时间
+        async with host_semaphores[host_of(channel[1])], semaphore:
+            return channel, await probe(session, channel)
+
+    limit = adjust_concurrency(len(channels), concurrency)
+    semaphore = asyncio.Semaphore(limit)
+    host_semaphores = defaultdict(lambda: asyncio.Semaphore(SPEED_LIMIT_PER_HOST))
+    async with aiohttp.ClientSession(connector=create_connector(limit)) as session:
+        tasks = [probe_channel(session, channel) for channel in channels]
+        for future in asyncio.as_completed(tasks):
+            channel, result = await future
+            if result:
+                speed_results.append(result)
+            else:
+                error_channels.append(channel)
+            progress = (len(speed_results) + len(error_channels)) / len(channels) * 100
+            print(f"可用频道：{len(speed_results)} 个 , 不可用频道：{len(error_channels)} 个 , 总频道：{len(channels)} 个 ,总进度：{progress:.2f} %。")
+    return speed_results, error_channels
+
+# 先写临时文件再原子替换，中途失败不会留下半截的输出文件
+def write_text_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def test_speed_and_output(channels, output_prefix="itvlist", concurrency=SPEED_CONCURRENCY):
+    # 测速前按(频道名, URL)去重，保持原有顺序，避免同一源被重复测速
+    channels = list(dict.fromkeys(channels))
+    speed_results, error_channels = run_async(probe_speeds(channels, concurrency))
+
+    # 按速度筛选每个频道最快的8个源
     channel_sources = defaultdict(list)
     for channel_name, channel_url, speed in speed_results:
         channel_sources[channel_name].append((channel_url, speed))
 
-    optimized_sources = []
-    for channel_name, sources in channel_sources.items():
-        sorted_sources = sorted(sources, key=lambda x: float(x[1].split()[0]), reverse=True)[:8]
-        for url, speed in sorted_sources:
-            optimized_sources.append((channel_name, url, speed))
-
-    # 去重
     unique_channels = []
-    seen = set()
-    for channel_name, channel_url, speed in optimized_sources:
-        key = (channel_name, channel_url)
-        if key not in seen:
-            unique_channels.append((channel_name, channel_url, speed))
-            seen.add(key)
+    for channel_name, sources in channel_sources.items():
+        for url, speed in heapq.nlargest(MAX_SOURCES_PER_CHANNEL, sources, key=lambda x: x[1]):
+            unique_channels.append((channel_name, url, speed))
 
     # 对频道进行排序
-    def custom_sort_key(item):
-        name = item[0]
-        if name.startswith('CCTV'):
-            num = re.search(r'\d+', name)
-            if num:
-                return (0, int(num.group()))
-            return (0, float('inf'))
-        return (1, name)
-
-    unique_channels.sort(key=custom_sort_key)
-
-    def write_to_file(file, results, genre):
-        channel_counters = {}
-        for result in results:
-            channel_name, channel_url, _ = result
-            if genre == '央视频道' and 'CCTV' in channel_name or \
-                    genre == '卫视频道' and '卫视' in channel_name or \
-                    genre == '其他频道' and 'CCTV' not in channel_name and '卫视' not in channel_name and '测试' not in channel_name:
-                if channel_name in channel_counters:
-                    if channel_counters[channel_name] < 8:
-                        file.write(f"{channel_name},{channel_url}\n")
-                        channel_counters[channel_name] += 1
-                else:
-                    file.write(f"{channel_name},{channel_url}\n")
-                    channel_counters[channel_name] = 1
-
-    with open(f"{output_prefix}.txt", 'w', encoding='utf-8') as txt_file:
-        txt_file.write('央视频道,#genre#\n')
-        write_to_file(txt_file, unique_channels, '央视频道')
-        txt_file.write('卫视频道,#genre#\n')
-        write_to_file(txt_file, unique_channels, '卫视频道')
-        txt_file.write('其他频道,#genre#\n')
-        write_to_file(txt_file, unique_channels, '其他频道')
-
-    with open(f"{output_prefix}.m3u", 'w', encoding='utf-8') as m3u_file:
-        m3u_file.write('#EXTM3U\n')
-        def write_to_m3u(file, results, genre):
-            channel_counters = {}
-            for result in results:
-                channel_name, channel_url, _ = result
-                if genre == '央视频道' and 'CCTV' in channel_name or \
-                        genre == '卫视频道' and '卫视' in channel_name or \
-                        genre == '其他频道' and 'CCTV' not in channel_name and '卫视' not in channel_name and '测试' not in channel_name:
-                    if channel_name in channel_counters:
-                        if channel_counters[channel_name] < 8:
-                            file.write(f"#EXTINF:-1 group-title=\"{genre}\",{channel_name}\n")
-                            file.write(f"{channel_url}\n")
-                            channel_counters[channel_name] += 1
-                    else:
-                        file.write(f"#EXTINF:-1 group-title=\"{genre}\",{channel_name}\n")
-                        file.write(f"{channel_url}\n")
-                        channel_counters[channel_name] = 1
-        write_to_m3u(m3u_file, unique_channels, '央视频道')
-        write_to_m3u(m3u_file, unique_channels, '卫视频道')
-        write_to_m3u(m3u_file, unique_channels, '其他频道')
-
-    with open("speed.txt", 'w', encoding='utf-8') as speed_file:
-        for result in unique_channels:
-            speed_file.write(f"{','.join(result)}\n")
+    unique_channels.sort(key=channel_sort_key)
+
+    # 一次遍历按分类归组，每个频道已按上限筛选过源
+    genre_channels = {genre: [] for genre in GENRES}
+    for item in unique_channels:
+        for genre in channel_genres(item[0]):
+            genre_channels[genre].append(item)
+
+    # 先在内存中拼接完整内容，再一次性写入文件
+    txt_buf = io.StringIO()
+    for genre, items in genre_channels.items():
+        txt_buf.write(f'{genre},#genre#\n')
+        for channel_name, channel_url, _ in items:
+            txt_buf.write(f"{channel_name},{channel_url}\n")
+    write_text_atomic(f"{output_prefix}.txt", txt_buf.getvalue())
+
+    m3u_buf = io.StringIO()
+    m3u_buf.write('#EXTM3U\n')
+    for genre, items in genre_channels.items():
+        extinf = f'#EXTINF:-1 group-title="{genre}",'
+        for channel_name, channel_url, _ in items:
+            m3u_buf.write(f"{extinf}{channel_name}\n{channel_url}\n")
+    write_text_atomic(f"{output_prefix}.m3u", m3u_buf.getvalue())
+
+    speed_buf = io.StringIO()
+    for channel_name, channel_url, speed in unique_channels:
+        speed_buf.write(f"{channel_name},{channel_url},{speed:.3f} MB/s\n")
+    write_text_atomic("speed.txt", speed_buf.getvalue())
 
 # 主入口函数
 def main():
@@ -358,21 +449,29 @@ def main():
     parser.add_argument('--txiptv', help='txiptv模式csv文件')
     parser.add_argument('--zhgxtv', help='zhgxtv模式csv文件')
     parser.add_argument('--output', default='itvlist', help='输出文件前缀')
+    parser.add_argument('--concurrency', type=int, default=SCAN_CONCURRENCY, help=f'C段扫描并发数（默认{SCAN_CONCURRENCY}）')
+    parser.add_argument('--speed-concurrency', type=int, default=SPEED_CONCURRENCY, help=f'测速并发数（默认{SPEED_CONCURRENCY}）')
     args = parser.parse_args()
+    if args.concurrency < 1:
+        print('错误：--concurrency 必须为正整数')
+        sys.exit(1)
+    if args.speed_concurrency < 1:
+        print('错误：--speed-concurrency 必须为正整数')
+        sys.exit(1)
 
     channels = []
     if args.jsmpeg:
-        channels.extend(get_channels_alltv(args.jsmpeg))
+        channels.extend(get_channels_alltv(args.jsmpeg, args.concurrency))
     if args.zhgxtv:
-        channels.extend(get_channels_hgxtv(args.zhgxtv))
+        channels.extend(get_channels_hgxtv(args.zhgxtv, args.concurrency))
     if args.txiptv:
-        channels.extend(asyncio.run(get_channels_newnew(args.txiptv)))
+        channels.extend(run_async(get_channels_newnew(args.txiptv, args.concurrency)))
 
     if not channels:
         print('请至少指定一个csv文件')
         return
 
-    test_speed_and_output(channels, args.output)
+    test_speed_and_output(channels, args.output, args.speed_concurrency)
 
 if __name__ == "__main__":
     main()
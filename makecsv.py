@@ -70,6 +70,10 @@ except ImportError:
         pass
 
 
+# IPv4地址格式校验，每条结果都要用，预先编译
+IPV4_RE = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
+
+
 class IPTVSourceCollector:
     """IPTV 源数据收集器"""
     
@@ -322,7 +326,7 @@ class IPTVSourceCollector:
                 
                 # 验证IP格式和端口
                 if (ip and port and 
-                    re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$', ip) and
+                    IPV4_RE.match(ip) and
                     port.isdigit() and 1 <= int(port) <= 65535):
                     
                     extracted_data.append({
@@ -495,7 +499,7 @@ class IPTVSourceCollector:
                         ip, port = match[-2], match[-1]
                     
                     # 验证IP格式和端口范围
-                    if (re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$', ip) and
+                    if (IPV4_RE.match(ip) and
                         port.isdigit() and 1 <= int(port) <= 65535):
                         
                         # 验证IP地址的每个段都在0-255范围内
@@ -643,13 +647,16 @@ class IPTVSourceCollector:
         }
         
         try:
+            # 复用同一会话，翻页时保持长连接
+            session = requests.Session()
+            session.headers.update(headers)
+            
             print("发送第一次请求获取总数据量...")
             # 添加延迟避免API限流
             time.sleep(2)
             
-            response = requests.post(
+            response = session.post(
                 'https://quake.360.net/api/v3/search/quake_service',
-                headers=headers,
                 json=query_data,
                 timeout=30
             )
@@ -696,9 +703,8 @@ class IPTVSourceCollector:
                     time.sleep(2)
                     
                     try:
-                        response = requests.post(
+                        response = session.post(
                             'https://quake.360.net/api/v3/search/quake_service',
-                            headers=headers,
                             json=query_data,
                             timeout=30
                         )
@@ -752,7 +758,7 @@ class IPTVSourceCollector:
                 port = item.get('port', '')
                 
                 # 确保ip和port都存在且有效
-                if ip and port and re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$', str(ip)):
+                if ip and port and IPV4_RE.match(str(ip)):
                     ip = str(ip).strip()
                     port = str(port).strip()
                     
@@ -924,9 +930,9 @@ class IPTVSourceCollector:
                 writer = csv.DictWriter(f, fieldnames=fieldnames)
                 
                 writer.writeheader()
-                for item in data:
-                    # 使用现有值或默认值
-                    row = {
+                # 使用现有值或默认值，一次性批量写入
+                writer.writerows(
+                    {
                         'host': item.get('host', ''),
                         'ip': item.get('ip', ''),
                         'port': item.get('port', ''),
@@ -938,7 +944,8 @@ class IPTVSourceCollector:
                         'link': item.get('link', ''),
                         'org': item.get('org', '')
                     }
-                    writer.writerow(row)
+                    for item in data
+                )
             
             print(f"已写入 {len(data)} 条数据到 {csv_file}")
             
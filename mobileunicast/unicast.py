@@ -17,18 +17,38 @@ IPTV 直播源处理工具（优化版）
 import os
 import re
 import sys
+import mmap
 import time
+import heapq
+import random
+import hashlib
+import itertools
 import socket
+import sqlite3
+import asyncio
 import argparse
-import requests
-from typing import Dict, List, Tuple, Optional
-from dataclasses import dataclass, field
+import aiohttp
+from typing import Dict, Iterator, List, Tuple, Optional
+from dataclasses import dataclass, replace
+from functools import lru_cache
 from pathlib import Path
 from urllib.parse import urlparse, urljoin
-from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import aiodns  # noqa: F401  aiohttp.AsyncResolver 依赖 aiodns
+    HAS_AIODNS = True
+except ImportError:
+    HAS_AIODNS = False
 
 # --------- 数据模型 ---------
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ChannelSource:
     name: str
     url: str
@@ -56,6 +76,55 @@ GROUPS = {
     ]
 }
 GROUP_OTHER = "其它频道"
+GROUP_NAMES = list(GROUPS)
+
+# 关键词 -> 所属分组序号（同一关键词出现在多个分组时取靠前的）
+KEYWORD_RANK: Dict[str, int] = {}
+for rank, keywords in enumerate(GROUPS.values()):
+    for kw in keywords:
+        KEYWORD_RANK.setdefault(kw, rank)
+# 全部关键词合成一个正则，零宽前瞻可找出重叠匹配；同一位置优先匹配靠前分组的关键词
+# 首个分组（央视）优先级最高，名称以其关键词开头时可直接判定，无需扫描
+TOP_GROUP_PREFIXES = tuple(GROUPS[GROUP_NAMES[0]])
+# 第二个分组（卫视）的关键词总在名称末尾，以其结尾且不含央视关键词时可直接判定
+SECOND_GROUP_SUFFIXES = tuple(GROUPS[GROUP_NAMES[1]])
+GROUP_KEYWORD_RE = re.compile("(?=(" + "|".join(map(re.escape, KEYWORD_RANK)) + "))")
+
+# 频道名归一化：去空格/横线，CCTV/CGTN前缀统一大写并紧贴编号，一次扫描完成
+NAME_NORM_RE = re.compile(r"[ -]|CCTV[-\s]*(\d+)|CGTN[-\s]*(\w+)", re.IGNORECASE)
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+# 测速下载量：256KB即认为可用
+PROBE_BYTES = 256 * 1024
+PROBE_HEADERS = {"Range": f"bytes=0-{PROBE_BYTES - 1}"}
+# 字节数换算为MB的系数
+BYTES_PER_MB = 1.0 / (1024 * 1024)
+# m3u8只读前64KB即可找到第一个分片，点播等长列表不必整份下载
+PLAYLIST_READ_SIZE = 64 * 1024
+# 测速建立连接的超时（秒），连不上的源尽早放弃
+PROBE_CONNECT_TIMEOUT = 3
+# 测速/下载并发数（单事件循环，协程数而非线程数）
+PROBE_CONCURRENCY = 128
+# 同一主机同时测速的上限，避免同一服务器上的大量频道互相挤占带宽或触发限流
+PROBE_HOST_CONCURRENCY = 4
+DOWNLOAD_CONCURRENCY = 32
+# 某频道已有top个不低于此速度（MB/s）的源时，其余源不再测速
+PROBE_ENOUGH_SPEED = 2.0
+# 测速前批量预解析域名的线程数
+DNS_CONCURRENCY = 64
+# 测速前TCP连通性预检的超时（秒），端口不通的源不再做完整HTTP测速
+TCP_CHECK_TIMEOUT = 2
+# 测速结果缓存默认有效期（小时），期内重复运行不再重测同一URL
+PROBE_CACHE_HOURS = 6
+
+# 频道行：name,url[#url...]，URL部分至少含一个http；不含逗号/http的行（注释、#EXTINF、空行等）直接跳过
+CHANNEL_LINE_RE = re.compile(rb"^([^,\r\n]*),([^\r\n]*http[^\r\n]*)", re.M)
+
+# 央视数字频道（CCTV1-CCTV17等）
+CCTV_NUM_RE = re.compile(r"^CCTV(\d{1,2})$")
+
+# m3u8中第一个非注释行（TS分片或子播放列表）
+TS_LINE_RE = re.compile(rb"^[ \t]*([^#\s][^\r\n]*)", re.M)
 
 DATA_SOURCES = [
     # 基础源/全国源/部分省份
@@ -98,164 +167,304 @@ DATA_SOURCES = [
 ]
 
 # --------- 工具函数 ---------
+def normalize_repl(m: re.Match) -> str:
+    if m.group(1):
+        return "CCTV" + m.group(1)
+    if m.group(2):
+        return "CGTN" + m.group(2)
+    return ""
+
+@lru_cache(maxsize=8192)
 def normalize_name(name: str) -> str:
-    """统一频道名格式"""
-    name = name.replace(' ', '').replace('-', '')
-    name = re.sub(r"CCTV[-\s]*(\d+)", r"CCTV\1", name, flags=re.IGNORECASE)
-    name = re.sub(r"CGTN[-\s]*(\w+)", r"CGTN\1", name, flags=re.IGNORECASE)
-    return name.strip()
+    """统一频道名格式（同名频道在各源中反复出现，结果按原始名称缓存）"""
+    return NAME_NORM_RE.sub(normalize_repl, name).strip()
 
 def classify_channel(name: str) -> str:
-    for group, keywords in GROUPS.items():
-        if any(kw in name for kw in keywords):
-            return group
-    return GROUP_OTHER
-
-def parse_line(line: str) -> Optional[Tuple[str, List[str]]]:
-    """解析一行频道，返回 (name, [urls]) 或 None"""
-    line = line.strip()
-    if not line or line.endswith("#genre#") or "," not in line:
-        return None
-    try:
-        name, urls = line.split(",", 1)
-        urls = [u for u in urls.split("#") if u.startswith("http")]
-        if not urls:
-            return None
-        return normalize_name(name), urls
-    except Exception:
-        return None
+    """一次扫描找出名称中所有关键词，归入最靠前的分组"""
+    if name.startswith(TOP_GROUP_PREFIXES):
+        return GROUP_NAMES[0]
+    if name.endswith(SECOND_GROUP_SUFFIXES) and not any(kw in name for kw in TOP_GROUP_PREFIXES):
+        return GROUP_NAMES[1]
+    ranks = [KEYWORD_RANK[m.group(1)] for m in GROUP_KEYWORD_RE.finditer(name)]
+    return GROUP_NAMES[min(ranks)] if ranks else GROUP_OTHER
+
+def parse_content(content: bytes) -> Iterator[Tuple[str, List[str]]]:
+    """逐个解析原始字节（bytes/mmap）中的频道行，产出 (name, [urls])；只解码命中的名称和URL"""
+    for m in CHANNEL_LINE_RE.finditer(content):
+        # 只去掉行尾空白：与原逐行解析一致，逗号后带空格的URL（" http://..."）不算有效
+        url_field = m.group(2).rstrip()
+        if url_field.endswith(b"#genre#"):
+            continue
+        urls = [u.decode("utf-8", "ignore") for u in url_field.split(b"#") if u.startswith(b"http")]
+        if urls:
+            yield normalize_name(m.group(1).decode("utf-8", "ignore")), urls
 
-def validate_url(url: str) -> bool:
-    """基本格式校验"""
-    return url.startswith("http")
+def parse_file(path: Path) -> List[Tuple[str, List[str]]]:
+    """内存映射解析单个源文件（在子进程中运行，只传回路径和解析结果）"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return list(parse_content(mm))
 
-def test_url_playable(url: str, proxy: Optional[str]=None, timeout: int=8) -> float:
+async def test_url_playable(session: aiohttp.ClientSession, url: str, proxy: Optional[str]=None, timeout: int=8) -> float:
     """只测试是否能快速连接并下载部分内容，返回速度，失败则为0"""
+    client_timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=PROBE_CONNECT_TIMEOUT)
     try:
-        proxies = {"http": proxy, "https": proxy} if proxy else None
-        headers = {"User-Agent": "Mozilla/5.0"}
-        # m3u8特殊处理:拿到第一个ts分片
+        # m3u8特殊处理:只读列表开头，拿到第一个ts分片
         if url.endswith(".m3u8"):
-            resp = requests.get(url, timeout=timeout, proxies=proxies, headers=headers)
-            if resp.status_code != 200: return 0.0
-            ts_lines = [l for l in resp.text.split('\n') if l and not l.startswith("#")]
-            if not ts_lines: return 0.0
-            ts_url = urljoin(url, ts_lines[0]) if not ts_lines[0].startswith("http") else ts_lines[0]
-            url = ts_url
-        # 测试下载部分内容
-        t0 = time.time()
-        r = requests.get(url, timeout=timeout, stream=True, proxies=proxies, headers=headers)
-        r.raise_for_status()
-        size = 0
-        for chunk in r.iter_content(8192):
-            size += len(chunk)
-            if size > 256*1024 or time.time() - t0 > timeout:  # 256KB+即认为可用
-                break
-        elapsed = time.time() - t0
-        return round(size/elapsed/1024/1024, 2) if elapsed > 0 else 0.0
+            async with session.get(url, proxy=proxy, timeout=client_timeout) as resp:
+                if resp.status != 200: return 0.0
+                try:
+                    head = await resp.content.readexactly(PLAYLIST_READ_SIZE)
+                except asyncio.IncompleteReadError as e:
+                    head = e.partial
+            m = TS_LINE_RE.search(head)
+            if not m: return 0.0
+            url = urljoin(url, m.group(1).strip().decode("utf-8", "ignore"))
+        # 测试下载部分内容：Range只请求前256KB，一次读取；不支持Range的源（如直播流）同样只读这么多
+        t0 = time.perf_counter()
+        async with session.get(url, proxy=proxy, timeout=client_timeout, headers=PROBE_HEADERS) as r:
+            r.raise_for_status()
+            try:
+                size = len(await r.content.readexactly(PROBE_BYTES))
+            except asyncio.IncompleteReadError as e:
+                size = len(e.partial)
+        elapsed = time.perf_counter() - t0
+        return size * BYTES_PER_MB / elapsed if elapsed > 0 else 0.0
     except Exception:
         return 0.0
 
+def url_endpoint(url: str) -> Optional[Tuple[str, int]]:
+    """URL对应的 (host, port)，无法解析时返回None"""
+    try:
+        p = urlparse(url)
+        if not p.hostname:
+            return None
+        return p.hostname, p.port or (443 if p.scheme == "https" else 80)
+    except ValueError:
+        return None
+
+def cctv_order(name: str) -> int:
+    m = CCTV_NUM_RE.match(name)
+    return int(m.group(1)) if m else 99
+
 def sort_cctv(channels: List[ChannelSource]) -> List[ChannelSource]:
     """央视频道排序"""
-    def cctv_order(name):
-        m = re.match(r"^CCTV(\d{1,2})$", name)
-        if m: return int(m.group(1))
-        return 99
-    # CCTV1-17先, 其余后
-    return sorted(channels, key=lambda x: (cctv_order(x.name), x.name, -x.speed), reverse=False)
+    # CCTV1-17先, 其余后；同名频道的排序键只算一次。
+    # 同名源在测速阶段已按速度从快到慢排好，sorted稳定，不必再比较速度
+    order = {name: cctv_order(name) for name in {c.name for c in channels}}
+    return sorted(channels, key=lambda x: (order[x.name], x.name))
+
+def write_text_atomic(path: Path, text: str) -> None:
+    """先写临时文件再原子替换，中途失败不会留下半截的输出文件"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+def run_async(coro):
+    """有 uvloop 时用其事件循环运行协程（基于libuv，系统调用更少），否则回退到asyncio"""
+    return uvloop.run(coro) if uvloop else asyncio.run(coro)
 
 # --------- 主处理类 ---------
 class IPTVProcessor:
-    def __init__(self, top: int = 10, proxy: Optional[str]=None):
+    def __init__(self, top: int = 10, proxy: Optional[str]=None, concurrency: int = PROBE_CONCURRENCY,
+                 cache_hours: float = PROBE_CACHE_HOURS):
         self.top = top
+        self.concurrency = concurrency
+        self.cache_ttl = int(cache_hours * 3600)
         self.proxy = proxy
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": "Mozilla/5.0"})
         socket.setdefaulttimeout(15)
         self.download_dir = Path("mobileunicast/downloads")
         self.output_dir = Path("output")
         self.download_dir.mkdir(parents=True, exist_ok=True)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = sqlite3.connect(self.download_dir / "probe.sqlite")
+        self.cache.execute("CREATE TABLE IF NOT EXISTS probe(url TEXT PRIMARY KEY, speed REAL, ts INTEGER)")
 
-    def download_sources(self) -> List[str]:
-        """下载所有源内容，返回所有文本内容字符串"""
-        def fetch(url):
+    def new_session(self, limit: int) -> aiohttp.ClientSession:
+        """共享连接池的会话，同一主机复用TCP/TLS连接并缓存DNS；有 aiodns 时异步解析，不占用线程池"""
+        resolver = aiohttp.AsyncResolver() if HAS_AIODNS else None
+        connector = aiohttp.TCPConnector(resolver=resolver, limit=limit, ttl_dns_cache=300)
+        return aiohttp.ClientSession(connector=connector, headers=HEADERS)
+
+    async def download_sources(self, pool: ProcessPoolExecutor) -> List[List[Tuple[str, List[str]]]]:
+        """下载所有源的原始内容到下载目录，每个源下载完即交给进程池解析（与其余下载重叠），
+        按 DATA_SOURCES 顺序返回成功源的解析结果"""
+        loop = asyncio.get_running_loop()
+        timeout = aiohttp.ClientTimeout(total=25)
+        # 用信号量限流，排队等待不计入单个请求的超时
+        semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+        async def fetch(session, url):
             try:
-                proxies = {"http": self.proxy, "https": self.proxy} if self.proxy else None
-                resp = self.session.get(url, timeout=25, proxies=proxies)
-                if resp.ok:
-                    print(f"✓ 下载 {url}")
-                    return resp.text
-                print(f"✗ 下载失败 {url}")
-                return ""
+                async with semaphore, session.get(url, proxy=self.proxy, timeout=timeout) as resp:
+                    if resp.status >= 400:
+                        print(f"✗ 下载失败 {url}")
+                        return None
+                    # 保留原始字节，不做编码探测和解码
+                    body = await resp.read()
             except Exception:
                 print(f"✗ 下载异常 {url}")
-                return ""
-        with ThreadPoolExecutor(max_workers=6) as pool:
-            results = list(pool.map(fetch, DATA_SOURCES))
-        # 合并所有文本
-        return [x for x in results if x.strip()]
-
-    def parse_channels(self, contents: List[str]) -> List[ChannelSource]:
-        """解析所有文本内容获得频道源"""
+                return None
+            if not body.strip():
+                print(f"✗ 下载为空 {url}")
+                return None
+            path = self.download_dir / f"{hashlib.md5(url.encode()).hexdigest()}.txt"
+            path.write_bytes(body)
+            print(f"✓ 下载 {url}")
+            return await loop.run_in_executor(pool, parse_file, path)
+        async with self.new_session(DOWNLOAD_CONCURRENCY) as session:
+            results = await asyncio.gather(*(fetch(session, url) for url in DATA_SOURCES))
+        return [r for r in results if r is not None]
+
+    def merge_channels(self, sources: List[List[Tuple[str, List[str]]]]) -> Tuple[List[ChannelSource], int]:
+        """合并各源解析结果，按频道名+url去重，重复项不再创建对象。返回 (去重后的频道源, 原始条目数)"""
         all_channels = []
-        for content in contents:
-            for line in content.splitlines():
-                parsed = parse_line(line)
-                if not parsed: continue
-                name, urls = parsed
+        seen = set()
+        total = 0
+        for parsed in sources:
+            for name, urls in parsed:
+                total += len(urls)
                 for url in urls:
-                    if validate_url(url):
+                    key = (name, url)
+                    if key not in seen:
+                        seen.add(key)
                         all_channels.append(ChannelSource(name=name, url=url))
-        return all_channels
+        return all_channels, total
 
-    def deduplicate(self, channels: List[ChannelSource]) -> List[ChannelSource]:
-        """频道名+url完全去重"""
-        seen = set()
-        result = []
-        for c in channels:
-            key = (c.name, c.url)
-            if key not in seen:
-                seen.add(key)
-                result.append(c)
-        return result
+    async def resolve_hosts(self, hosts) -> Dict[str, List[str]]:
+        """多线程批量解析主机名（每个主机只解析一次），返回 {主机: [IP...]}，无法解析的主机不在其中"""
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=DNS_CONCURRENCY) as pool:
+            async def resolve(host):
+                try:
+                    infos = await loop.run_in_executor(pool, socket.getaddrinfo, host, None, 0, socket.SOCK_STREAM)
+                    # 保留全部地址（去重保序），连接预检时逐个尝试
+                    addrs = list(dict.fromkeys(info[4][0] for info in infos))
+                    return (host, addrs) if addrs else None
+                except (OSError, UnicodeError, IndexError):
+                    # 空标签/超长标签的主机名（如 a..b）getaddrinfo 抛 UnicodeError，同样记为无法解析
+                    return None
+            results = await asyncio.gather(*(resolve(h) for h in hosts))
+        return dict(r for r in results if r)
 
-    def filter_playable(self, channels: List[ChannelSource]) -> List[ChannelSource]:
-        """多线程测试源可播放性和速度，只保留可播放的"""
+    async def check_endpoints(self, endpoints, addrs: Dict[str, List[str]]) -> set:
+        """并发尝试TCP连接（每个host:port只检查一次，直接连已解析的IP），
+        所有地址都连不上才算失败，返回连接失败的 (host, port) 集合"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async def check(ep):
+            async with semaphore:
+                for addr in addrs[ep[0]]:
+                    try:
+                        conn = asyncio.open_connection(addr, ep[1])
+                        _, writer = await asyncio.wait_for(conn, TCP_CHECK_TIMEOUT)
+                    except (OSError, asyncio.TimeoutError):
+                        continue
+                    writer.close()
+                    return None
+            return ep
+        results = await asyncio.gather(*(check(ep) for ep in endpoints))
+        return {ep for ep in results if ep}
+
+    async def filter_playable(self, channels: List[ChannelSource]) -> Dict[str, List[ChannelSource]]:
+        """协程并发测试源可播放性和速度，每个频道只保留可播放且速度最快的N个源"""
         print(f"开始频道测速（仅保留可播放的源）...")
-        tested = []
-        with ThreadPoolExecutor(max_workers=8) as pool:
-            future2ch = {pool.submit(test_url_playable, c.url, self.proxy): c for c in channels}
+        # 每个频道名一个大小为top的最小堆，边测速边淘汰较慢的源，内存只与 频道数×top 相关；
+        # 序号取负保证同速时先到的源优先保留
+        heaps: Dict[str, list] = {}
+        seq = itertools.count()
+        playable = 0
+        def keep(ch):
+            heap = heaps.setdefault(ch.name, [])
+            item = (ch.speed, -next(seq), ch)
+            if len(heap) < self.top:
+                heapq.heappush(heap, item)
+            else:
+                heapq.heappushpop(heap, item)
+        def satisfied(name):
+            heap = heaps.get(name)
+            return heap is not None and len(heap) >= self.top and heap[0][0] >= PROBE_ENOUGH_SPEED
+        # 先查缓存，命中的URL（含已知失效的）直接复用上次测速结果；有效期为0时全部重测
+        # 过期记录先删掉，缓存表只保留有效期内的URL，不会随运行次数无限增长
+        cutoff = int(time.time()) - self.cache_ttl
+        self.cache.execute("DELETE FROM probe WHERE ts <= ?", (cutoff,))
+        cached = {}
+        if self.cache_ttl > 0:
+            cached = dict(self.cache.execute("SELECT url, speed FROM probe WHERE ts > ?", (cutoff,)))
+        pending = []
+        for c in channels:
+            if c.url in cached:
+                speed = cached[c.url]
+                if speed > 0:
+                    keep(replace(c, speed=speed, status=True))
+                    playable += 1
+            else:
+                pending.append(c)
+        if cached:
+            print(f"  命中测速缓存 {len(channels) - len(pending)} 个，待检测 {len(pending)} 个")
+        # 两级预筛：域名解析失败或端口连不上的源不再发起HTTP测速，直接记为不可用；
+        # 使用代理时由代理解析和连接，跳过此步
+        to_probe = pending
+        # 待写入缓存的测速结果，预筛掉的源记为0
+        speeds = {}
+        if pending and not self.proxy:
+            endpoints = [url_endpoint(c.url) for c in pending]
+            hosts = {ep[0] for ep in endpoints if ep}
+            addrs = await self.resolve_hosts(hosts)
+            live = {ep for ep in endpoints if ep and ep[0] in addrs}
+            dead = await self.check_endpoints(live, addrs)
+            to_probe = []
+            for c, ep in zip(pending, endpoints):
+                if ep in live and ep not in dead:
+                    to_probe.append(c)
+                else:
+                    speeds[c.url] = 0.0
+            if len(to_probe) < len(pending):
+                print(f"  {len(hosts) - len(addrs)} 个域名无法解析，{len(dead)} 个端口不通，跳过 {len(pending) - len(to_probe)} 个源")
+        # 同一URL常出现在不同频道名下，按URL只测一次，结果分给引用它的所有频道
+        url_channels: Dict[str, List[ChannelSource]] = defaultdict(list)
+        for c in to_probe:
+            url_channels[c.url].append(c)
+        urls = list(url_channels)
+        if len(urls) < len(to_probe):
+            print(f"  {len(to_probe) - len(urls)} 个源与其他频道URL相同，合并测速")
+        # 打乱顺序，让各源/各服务器都能较早被测到，而不是先测完排在前面的源文件
+        random.shuffle(urls)
+        skipped = 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+        host_semaphores = defaultdict(lambda: asyncio.Semaphore(PROBE_HOST_CONCURRENCY))
+        async def probe(session, url):
+            # 先排主机队列再占全局名额，等待繁忙主机的任务不占用全局并发
+            async with host_semaphores[url_endpoint(url)], semaphore:
+                # 排队期间引用该URL的频道可能都已凑够足够快的源，不再测速
+                if all(satisfied(c.name) for c in url_channels[url]):
+                    return url, None
+                speed = await test_url_playable(session, url, self.proxy)
+            return url, speed
+        async with self.new_session(self.concurrency) as session:
+            total = len(urls)
             i = 0
-            for fut in as_completed(future2ch):
-                ch = future2ch[fut]
-                try:
-                    speed = fut.result(timeout=15)
-                except Exception:
-                    speed = 0.0
-                ch.status = speed > 0
-                ch.speed = speed
-                if ch.status:
-                    tested.append(ch)
+            for fut in asyncio.as_completed([probe(session, url) for url in urls]):
+                url, speed = await fut
                 i += 1
-                if i % 10 == 0 or i == len(future2ch):
-                    print(f"  [{i}/{len(future2ch)}] 已检测...")
-        print(f"测速完成，保留 {len(tested)} 个可播放频道源")
-        return tested
-
-    def pick_fastest(self, channels: List[ChannelSource]) -> Dict[str, List[ChannelSource]]:
-        """每个频道只保留速度最快的N个源，并分组"""
-        grouped: Dict[str, List[ChannelSource]] = {}
-        # 先按频道名分组
-        name2channels: Dict[str, List[ChannelSource]] = {}
-        for c in channels:
-            name2channels.setdefault(c.name, []).append(c)
-        # 对每组选速度最快的N个
-        for name, group in name2channels.items():
-            fastest = sorted(group, key=lambda x: x.speed, reverse=True)[:self.top]
-            grouped[name] = fastest
-        return grouped
+                if speed is None:
+                    skipped += len(url_channels[url])
+                else:
+                    speeds[url] = speed
+                    if speed > 0:
+                        for c in url_channels[url]:
+                            keep(replace(c, speed=speed, status=True))
+                        playable += len(url_channels[url])
+                if i % 10 == 0 or i == total:
+                    print(f"  [{i}/{total}] 已检测...")
+        now = int(time.time())
+        self.cache.executemany("INSERT OR REPLACE INTO probe VALUES (?, ?, ?)",
+                               ((url, speed, now) for url, speed in speeds.items()))
+        self.cache.commit()
+        name2channels = {name: [item[2] for item in sorted(heap, reverse=True)]
+                         for name, heap in heaps.items()}
+        kept = sum(len(chs) for chs in name2channels.values())
+        if skipped:
+            print(f"  {skipped} 个源所属频道已有足够快的源，跳过测速")
+        print(f"测速完成，可播放频道源 {playable} 个，每频道保留最快{self.top}个后共 {kept} 个")
+        return name2channels
 
     def group_channels(self, name2channels: Dict[str, List[ChannelSource]]) -> Dict[str, List[ChannelSource]]:
         """分组"""
@@ -272,59 +481,69 @@ class IPTVProcessor:
         """输出 m3u 和 txt 文件"""
         m3u_path = self.output_dir / "iptv.m3u"
         txt_path = self.output_dir / "iptv.txt"
-        # M3U
-        with open(m3u_path, "w", encoding="utf-8") as f:
-            f.write("#EXTM3U\n")
-            for group, chs in grouped.items():
-                for ch in chs:
-                    f.write(f'#EXTINF:-1 group-title="{group}",{ch.name}\n{ch.url}\n')
-        # TXT
-        with open(txt_path, "w", encoding="utf-8") as f:
-            for group, chs in grouped.items():
-                if not chs: continue
-                f.write(f"{group},#genre#\n")
-                for ch in chs:
-                    f.write(f"{ch.name},{ch.url}\n")
-                f.write("\n")
+        # 一次遍历同时生成 M3U 和 TXT 内容，在内存中拼好后各一次写入
+        m3u_lines = ["#EXTM3U\n"]
+        txt_lines = []
+        for group, chs in grouped.items():
+            if not chs: continue
+            txt_lines.append(f"{group},#genre#\n")
+            for ch in chs:
+                m3u_lines.append(f'#EXTINF:-1 group-title="{group}",{ch.name}\n{ch.url}\n')
+                txt_lines.append(f"{ch.name},{ch.url}\n")
+            txt_lines.append("\n")
+        write_text_atomic(m3u_path, "".join(m3u_lines))
+        write_text_atomic(txt_path, "".join(txt_lines))
         print(f"已生成: {m3u_path} (M3U格式)")
         print(f"已生成: {txt_path} (TXT格式)")
 
     def run(self):
-        print("=== IPTV直播源处理工具（可播放优化版） ===")
-        print(f"数据源数量：{len(DATA_SOURCES)}，每频道保留最快{self.top}个源")
-        if self.proxy:
-            print(f"使用代理: {self.proxy}")
-        # 1. 下载
-        contents = self.download_sources()
-        if not contents:
-            print("未能获取任何源内容，退出。")
-            return
-        # 2. 解析
-        raw_channels = self.parse_channels(contents)
-        print(f"解析获得原始频道源: {len(raw_channels)}")
-        # 3. 去重
-        channels = self.deduplicate(raw_channels)
-        print(f"去重后频道源: {len(channels)}")
-        # 4. 可用性检测+测速
-        playable_channels = self.filter_playable(channels)
-        # 5. 每频道只保留最快的N个
-        name2channels = self.pick_fastest(playable_channels)
-        # 6. 分组
-        grouped = self.group_channels(name2channels)
-        # 7. 输出
-        self.save_outputs(grouped)
-        print("=== 处理完成 ===")
+        try:
+            print("=== IPTV直播源处理工具（可播放优化版） ===")
+            print(f"数据源数量：{len(DATA_SOURCES)}，每频道保留最快{self.top}个源")
+            if self.proxy:
+                print(f"使用代理: {self.proxy}")
+            # 1. 下载+解析（解析是纯CPU工作，在进程池中并行）
+            with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+                sources = run_async(self.download_sources(pool))
+            if not sources:
+                print("未能获取任何源内容，退出。")
+                return
+            # 2. 合并去重
+            channels, total = self.merge_channels(sources)
+            print(f"解析获得原始频道源: {total}")
+            print(f"去重后频道源: {len(channels)}")
+            # 3. 可用性检测+测速，每频道只保留最快的N个
+            name2channels = run_async(self.filter_playable(channels))
+            # 4. 分组
+            grouped = self.group_channels(name2channels)
+            # 5. 输出
+            self.save_outputs(grouped)
+            print("=== 处理完成 ===")
+        finally:
+            # 关闭测速缓存数据库
+            self.cache.close()
 
 # --------- 命令行入口 ---------
 def main():
     parser = argparse.ArgumentParser(description="IPTV直播源处理工具（可播放优化版）")
     parser.add_argument("--top", type=int, default=10, help="每频道最多保留最快N个源")
     parser.add_argument("--proxy", type=str, help="全局HTTP代理（如 http://127.0.0.1:7890 ）")
+    parser.add_argument("--concurrency", type=int, default=PROBE_CONCURRENCY,
+                        help=f"测速并发数（默认 {PROBE_CONCURRENCY}）")
+    parser.add_argument("--cache-hours", type=float, default=PROBE_CACHE_HOURS,
+                        help=f"测速结果缓存有效期（小时，默认 {PROBE_CACHE_HOURS}，0 表示不使用缓存全部重测）")
     args = parser.parse_args()
     if args.top < 1:
         print("错误：--top 必须为正整数")
         sys.exit(1)
-    IPTVProcessor(top=args.top, proxy=args.proxy).run()
+    if args.concurrency < 1:
+        print("错误：--concurrency 必须为正整数")
+        sys.exit(1)
+    if args.cache_hours < 0:
+        print("错误：--cache-hours 不能为负数")
+        sys.exit(1)
+    IPTVProcessor(top=args.top, proxy=args.proxy, concurrency=args.concurrency,
+                  cache_hours=args.cache_hours).run()
 
 if __name__ == "__main__":
     main()
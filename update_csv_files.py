@@ -12,13 +12,13 @@ CSV_SOURCES = {
 HISTORY_DIR = "history"
 os.makedirs(HISTORY_DIR, exist_ok=True)
 
-def fetch_csv(file_name, url):
+def fetch_csv(session, file_name, url):
     """
-    从网络获取 IPTV CSV 文件内容
+    从网络获取 IPTV CSV 文件内容（原始字节，不做解码）
     """
-    resp = requests.get(url, timeout=15)
+    resp = session.get(url, timeout=15)
     resp.raise_for_status()
-    return resp.text
+    return resp.content
 
 def save_history(file_path, content):
     """
@@ -27,7 +27,7 @@ def save_history(file_path, content):
     basename = os.path.basename(file_path)
     timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
     hist_file = os.path.join(HISTORY_DIR, f"{basename}.{timestamp}.bak")
-    with open(hist_file, "w", encoding="utf-8") as f:
+    with open(hist_file, "wb") as f:
         f.write(content)
 
 def is_valid_csv(content):
@@ -43,19 +43,19 @@ def is_valid_csv(content):
     except Exception:
         return False
 
-def update_csv(file_name, url):
+def update_csv(session, file_name, url):
     print(f"检查并同步: {file_name}")
-    local_content = ""
+    local_content = b""
     if os.path.exists(file_name):
-        with open(file_name, "r", encoding="utf-8") as f:
+        with open(file_name, "rb") as f:
             local_content = f.read()
     # 获取远程内容
     try:
-        new_content = fetch_csv(file_name, url)
+        new_content = fetch_csv(session, file_name, url)
     except Exception as e:
         print(f"获取 {file_name} 失败: {e}")
         return
-    if not is_valid_csv(new_content):
+    if not is_valid_csv(new_content.decode("utf-8", errors="replace")):
         print(f"{file_name} 下载内容无效，跳过。")
         return
     # 内容有变则备份并写入
@@ -63,14 +63,16 @@ def update_csv(file_name, url):
         print(f"{file_name} 内容有变，自动保存历史并更新。")
         if local_content.strip():
             save_history(file_name, local_content)
-        with open(file_name, "w", encoding="utf-8") as f:
+        with open(file_name, "wb") as f:
             f.write(new_content)
     else:
         print(f"{file_name} 无变化。")
 
 def main():
-    for file_name, url in CSV_SOURCES.items():
-        update_csv(file_name, url)
+    # 所有CSV来自同一主机，共用一个Session复用连接
+    with requests.Session() as session:
+        for file_name, url in CSV_SOURCES.items():
+            update_csv(session, file_name, url)
 
 if __name__ == "__main__":
     main()